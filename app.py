@@ -1,20 +1,22 @@
 import re
+import atexit
 import asyncio
-import subprocess
-import time
 import logging
-import traceback
-import json
-import requests
+import time
+import threading
+import anyio
+import httpx
+import orjson
+from cachetools import TTLCache
 from textwrap import dedent
 from agno.agent import Agent
-from agno.tools.mcp import MultiMCPTools
+from agno.tools.mcp import MCPTools
 from agno.tools.googlesearch import GoogleSearchTools
 from agno.models.openai import OpenAIChat
-from icalendar import Calendar, Event
-from datetime import datetime, timedelta
+from agno.run.response import RunResponseCancelledEvent, RunResponseContentEvent, RunResponseErrorEvent
+from mcp.shared.exceptions import McpError
+from datetime import date, datetime, timedelta, timezone
 import streamlit as st
-from datetime import date
 import os
 from dotenv import load_dotenv
 
@@ -32,164 +34,151 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class TravelPlannerApp:
-    """Main application class for Travel Planner with MCP integration."""
-    
-    def __init__(self):
-        """Initialize the application."""
-        pass
-    
+# Itineraries depend on live flight prices, so cached results are only reused for 10 minutes
+ITINERARY_CACHE_TTL_SECONDS = 600
+ITINERARY_CACHE_MAXSIZE = 128
 
-        
+# MCP tool responses are cached per tool; airport metadata is effectively static, flight offers are not
+TOOL_CACHE_MAXSIZE = 512
+DEFAULT_TOOL_CACHE_TTL_SECONDS = 1800
+TOOL_CACHE_TTL_SECONDS = {
+    "search_airports": 6 * 3600,
+    "search_flights": 600,
+    "get_flight_prices": 600,
+}
 
+# Built-in MCP servers launched over stdio, plus our custom Flight Search MCP server over HTTP
+MCP_SERVER_COMMANDS = [
+    "npx -y @openbnb/mcp-server-airbnb --ignore-robots-txt",
+    "npx @gongrzhe/server-travelplanner-mcp",
+]
+FLIGHT_SEARCH_MCP_URL = "http://localhost:8001/mcp"
+MCP_TIMEOUT_SECONDS = 60
+MCP_PING_TIMEOUT_SECONDS = 5
 
-def generate_ics_content(plan_text: str, start_date: datetime = None) -> bytes:
-    """
-    Generate an ICS calendar file from a travel itinerary text.
+# Failures that leave an MCP transport unusable, as opposed to errors of a single request
+_CONNECTION_ERRORS = (ConnectionError, anyio.ClosedResourceError, anyio.BrokenResourceError, McpError)
 
-    Args:
-        plan_text: The travel itinerary text
-        start_date: Optional start date for the itinerary (defaults to today)
+# Airport metadata is effectively static, so it is kept on disk for 30 days; popular airports ship in a seed file
+AIRPORT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "travel_planner", "airports.json")
+AIRPORT_SEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "airports_seed.json")
+AIRPORT_CACHE_TTL_SECONDS = 30 * 24 * 3600
 
-    Returns:
-        bytes: The ICS file content as bytes
+# Upper bound on concurrent MCP requests issued by the flight data pre-fetch
+MAX_CONCURRENT_PREFETCH_CALLS = 4
+
+# How long the UI waits for new itinerary text before refreshing the progress label
+PLANNER_POLL_SECONDS = 0.5
+
+# Matches each "Day N" section of an itinerary up to the next day heading
+_DAY_PATTERN = re.compile(r'Day (\d+)[:\s]+(.*?)(?=Day \d+|$)', re.DOTALL)
+
+# Terms in a generated itinerary that show which MCP servers contributed data
+_FLIGHT_MARKERS = frozenset({"search_flights", "search_airports", "get_flight_prices", "serpapi_response", "flight data", "airline", "booking link"})
+_AIRBNB_MARKERS = frozenset({"listing", "accommodation"})
+_MAPS_MARKERS = frozenset({"maps", "location"})
+_MCP_MARKER_PATTERN = re.compile(
+    "|".join(map(re.escape, sorted(_FLIGHT_MARKERS | _AIRBNB_MARKERS | _MAPS_MARKERS | {"airbnb", "distance"}))),
+    re.IGNORECASE,
+)
+
+# Static agent configuration and prompt templates, shared by every request
+_AGENT_DESCRIPTION = dedent(
+    """\
+    You are a professional travel consultant AI that creates highly detailed travel itineraries with real flight data, accommodation options, and location services.
+
+    You have access to:
+    ✈️ Flight Search MCP with these tools:
+       - search_flights: Find real flights with prices, airlines, departure/arrival times, and booking links
+       - search_airports: Search for airport information and IATA codes
+       - get_flight_prices: Get price trends and insights for flights
+    🏨 Airbnb listings with real availability and current pricing
+    🗺️ Google Maps MCP for location services, directions, distance calculations, and local navigation
+    🔍 Web search capabilities for current information, reviews, and travel updates
+
+    ALWAYS create a complete, detailed itinerary immediately without asking for clarification or additional information.
+    {flight_guidance}
+    Use Google Maps MCP extensively to calculate distances between all locations and provide precise travel times.
+    Use Airbnb MCP to find real accommodation options with current pricing.
+    If information is missing, use your best judgment and available tools to fill in the gaps.
     """
-    cal = Calendar()
-    cal.add('prodid','-//AI Travel Planner//github.com//')
-    cal.add('version', '2.0')
+)
 
-    if start_date is None:
-        start_date = datetime.today()
+_FLIGHT_GUIDANCE = "Use Flight Search MCP tools extensively to find real flights, airport information, and price trends."
+_PREFETCHED_FLIGHT_GUIDANCE = "Use the pre-fetched Flight Search MCP data in the prompt for flights, airport information, and price trends, and call Flight Search MCP tools only for data it does not include."
 
-    # Split the plan into days
-    day_pattern = re.compile(r'Day (\d+)[:\s]+(.*?)(?=Day \d+|$)', re.DOTALL)
-    days = day_pattern.findall(plan_text)
+# Instruction that comes before the flight tool instructions
+_AGENT_LEADING_INSTRUCTION = "IMPORTANT: Never ask questions or request clarification - always generate a complete itinerary"
 
-    if not days:  # If no day pattern found, create a single all-day event with the entire content
-        event = Event()
-        event.add('summary', "Travel Itinerary")
-        event.add('description', plan_text)
-        event.add('dtstart', start_date.date())
-        event.add('dtend', start_date.date())
-        event.add("dtstamp", datetime.now())
-        cal.add_component(event)
-    else:
-        # Process each day
-        for day_num, day_content in days:
-            day_num = int(day_num)
-            current_date = start_date + timedelta(days=day_num - 1)
+_FLIGHT_TOOLS_HEADER = "Use Flight Search MCP tools extensively:"
+_PREFETCHED_FLIGHT_TOOLS_HEADER = "Use the pre-fetched Flight Search MCP data in the prompt, and only call Flight Search MCP tools for data it does not include:"
 
-            # Create a single event for the entire day
-            event = Event()
-            event.add('summary', f"Day {day_num} Itinerary")
-            event.add('description', day_content.strip())
+_AGENT_FLIGHT_TOOL_INSTRUCTIONS = {
+    "search_flights": "  - Use search_flights to find real flights with prices, airlines, departure/arrival times, and booking links",
+    "search_airports": "  - Use search_airports to find airport information and IATA codes for the destination",
+    "get_flight_prices": "  - Use get_flight_prices to analyze price trends and find the best time to book",
+}
+_AGENT_PREFETCHED_TOOL_INSTRUCTION = "  - Do not call {tool_name}; its results are already provided in the prompt"
 
-            # Make it an all-day event
-            event.add('dtstart', current_date.date())
-            event.add('dtend', current_date.date())
-            event.add("dtstamp", datetime.now())
-            cal.add_component(event)
+# Instructions that come after the flight tool instructions
+_AGENT_INSTRUCTIONS = [
+    "Research the destination thoroughly using all available tools to gather comprehensive current information",
+    "Find suitable accommodation options within the budget using Airbnb MCP with real prices and availability",
+    "Create an extremely detailed day-by-day itinerary with specific activities, locations, exact timing, and distances",
+    "Use Google Maps MCP extensively to calculate distances between ALL locations and provide travel times",
+    "Include detailed transportation options and turn-by-turn navigation tips using Google Maps MCP",
+    "Research dining options with specific restaurant names, addresses, price ranges, and distance from accommodation",
+    "Check current weather conditions, seasonal factors, and provide detailed packing recommendations",
+    "Calculate precise estimated costs for EVERY aspect of the trip and ensure recommendations fit within budget",
+    "Include detailed information about each attraction: opening hours, ticket prices, best visiting times, and distance from accommodation",
+    "Add practical information including local transportation costs, currency exchange, safety tips, and cultural norms",
+    "Structure the itinerary with clear sections, detailed timing for each activity, and include buffer time between activities",
+    "Use all available tools proactively without asking for permission",
+    "Generate the complete, detailed itinerary in one response without follow-up questions",
+]
 
-    return cal.to_ical()
+_FLIGHT_TOOL_INSTRUCTIONS = {
+    "search_flights": '* Use search_flights with source="{source}", destination="{destination}", departure_date="{start_date}" to find real flights with prices, airlines, departure/arrival times, and booking links',
+    "search_airports": "* Use search_airports to find airport information and IATA codes for both source and destination",
+    "get_flight_prices": '* Use get_flight_prices with source="{source}", destination="{destination}", departure_date="{start_date}" to analyze price trends and find the best time to book',
+}
+_PREFETCHED_TOOL_INSTRUCTION = "* {tool_name} results are already included in <{block}> - use them directly and do not call {tool_name} again"
+_PREFETCHED_BLOCKS = {"search_airports": "airport_info"}
 
-async def run_mcp_travel_planner(source: str, destination: str, num_days: int, preferences: str, budget: int, start_date: str, return_date: str = None):
-    """Run the MCP-based travel planner agent with real-time data access."""
+# Where each flight section of the output format gets its data
+_OUTPUT_TOOL_SOURCE = "use {tool_name} tool"
+_PREFETCHED_OUTPUT_SOURCE = "from <{block}>"
 
-    try:
-        # Get API keys from environment variables
-        openai_key = os.getenv("OPENAI_API_KEY")
-        google_maps_key = os.getenv("GOOGLE_MAPS_API_KEY")
-        
-        if not openai_key or not google_maps_key:
-            raise ValueError("Missing required API keys in environment variables")
+_PREFETCHED_SECTION_TEMPLATE = """
+        **Pre-fetched Flight Data (real Flight Search MCP results):**
+        <prefetched_data>
+        {data}
+        </prefetched_data>
+"""
 
-        # Initialize MultiMCPTools with built-in MCP servers and our custom Flight Search MCP
-        multi_mcp_tools = MultiMCPTools(
-            commands=[
-                "npx -y @openbnb/mcp-server-airbnb --ignore-robots-txt",
-                "npx @gongrzhe/server-travelplanner-mcp"
-            ],
-            urls=["http://localhost:8001/mcp"],  # Our custom Flight Search MCP server
-            urls_transports=["streamable-http"],
-            env={
-                "GOOGLE_MAPS_API_KEY": google_maps_key,
-                "SERPAPI_KEY": os.getenv("SERPAPI_KEY", ""),
-            },
-            timeout_seconds=60,
-        )   
-
-        # Connect to all MCP servers
-        await multi_mcp_tools.connect()
-
-        travel_planner = Agent(
-            name="Travel Planner",
-            role="Creates comprehensive travel itineraries using Airbnb, Google Maps, and Flight Search MCP servers",
-            model=OpenAIChat(id="gpt-4o", api_key=openai_key),
-            description=dedent(
-                """\
-                You are a professional travel consultant AI that creates highly detailed travel itineraries with real flight data, accommodation options, and location services.
-
-                You have access to:
-                ✈️ Flight Search MCP with these tools:
-                   - search_flights: Find real flights with prices, airlines, departure/arrival times, and booking links
-                   - search_airports: Search for airport information and IATA codes
-                   - get_flight_prices: Get price trends and insights for flights
-                🏨 Airbnb listings with real availability and current pricing
-                🗺️ Google Maps MCP for location services, directions, distance calculations, and local navigation
-                🔍 Web search capabilities for current information, reviews, and travel updates
-
-                ALWAYS create a complete, detailed itinerary immediately without asking for clarification or additional information.
-                Use Flight Search MCP tools extensively to find real flights, airport information, and price trends.
-                Use Google Maps MCP extensively to calculate distances between all locations and provide precise travel times.
-                Use Airbnb MCP to find real accommodation options with current pricing.
-                If information is missing, use your best judgment and available tools to fill in the gaps.
-                """
-            ),
-            instructions=[
-                "IMPORTANT: Never ask questions or request clarification - always generate a complete itinerary",
-                "Use Flight Search MCP tools extensively:",
-                "  - Use search_flights to find real flights with prices, airlines, departure/arrival times, and booking links",
-                "  - Use search_airports to find airport information and IATA codes for the destination",
-                "  - Use get_flight_prices to analyze price trends and find the best time to book",
-                "Research the destination thoroughly using all available tools to gather comprehensive current information",
-                "Find suitable accommodation options within the budget using Airbnb MCP with real prices and availability",
-                "Create an extremely detailed day-by-day itinerary with specific activities, locations, exact timing, and distances",
-                "Use Google Maps MCP extensively to calculate distances between ALL locations and provide travel times",
-                "Include detailed transportation options and turn-by-turn navigation tips using Google Maps MCP",
-                "Research dining options with specific restaurant names, addresses, price ranges, and distance from accommodation",
-                "Check current weather conditions, seasonal factors, and provide detailed packing recommendations",
-                "Calculate precise estimated costs for EVERY aspect of the trip and ensure recommendations fit within budget",
-                "Include detailed information about each attraction: opening hours, ticket prices, best visiting times, and distance from accommodation",
-                "Add practical information including local transportation costs, currency exchange, safety tips, and cultural norms",
-                "Structure the itinerary with clear sections, detailed timing for each activity, and include buffer time between activities",
-                "Use all available tools proactively without asking for permission",
-                "Generate the complete, detailed itinerary in one response without follow-up questions"
-            ],
-            tools=[multi_mcp_tools, GoogleSearchTools()],
-            add_datetime_to_instructions=True,
-            markdown=True,
-            show_tool_calls=False,
-        )
+_AIRPORT_INFO_SECTION_TEMPLATE = """
+        **Airport Information (IATA code lookups):**
+        <airport_info>
+        {data}
+        </airport_info>
+"""
 
-        # Create the planning prompt
-        prompt = f"""
+_PROMPT_TEMPLATE = """
         IMMEDIATELY create an extremely detailed and comprehensive travel itinerary for:
 
         **Source Airport:** {source}
         **Destination Airport:** {destination}
         **Departure Date:** {start_date}
-        **Return Date:** {return_date if return_date else "One-way trip"}
+        **Return Date:** {return_date}
         **Duration:** {num_days} days
         **Budget:** ${budget} USD total
         **Preferences:** {preferences}
-
+{prefetched_section}
         DO NOT ask any questions. Generate a complete, highly detailed itinerary now using all available tools.
 
         **CRITICAL REQUIREMENTS:**
-        - Use Flight Search MCP tools extensively:
-          * Use search_flights with source="{source}", destination="{destination}", departure_date="{start_date}" to find real flights with prices, airlines, departure/arrival times, and booking links
-          * Use search_airports to find airport information and IATA codes for both source and destination
-          * Use get_flight_prices with source="{source}", destination="{destination}", departure_date="{start_date}" to analyze price trends and find the best time to book
+        - {flight_tools_header}
+          {flight_tools}
         - Use Google Maps MCP to calculate distances and travel times between ALL locations
         - Use Airbnb MCP to find real accommodation options with current pricing and availability
         - Include specific addresses for every location, restaurant, and attraction
@@ -199,9 +188,9 @@ async def run_mcp_travel_planner(source: str, destination: str, num_days: int, p
         - Provide detailed weather information and specific packing recommendations
 
         **REQUIRED OUTPUT FORMAT:**
-        1. **Flight Information** - Real flight options from {source} to {destination} with prices, airlines, times, and booking links (use search_flights tool)
-        2. **Airport Information** - Airport details and IATA codes for both {source} and {destination} (use search_airports tool)
-        3. **Price Analysis** - Price trends and best booking times for {source} to {destination} route (use get_flight_prices tool)
+        1. **Flight Information** - Real flight options from {source} to {destination} with prices, airlines, times, and booking links ({search_flights_source})
+        2. **Airport Information** - Airport details and IATA codes for both {source} and {destination} ({search_airports_source})
+        3. **Price Analysis** - Price trends and best booking times for {source} to {destination} route ({get_flight_prices_source})
         4. **Trip Overview** - Summary, total estimated cost breakdown, detailed weather forecast
         5. **Accommodation** - 3 specific Airbnb options with real prices, addresses, amenities, and distance from city center (use Airbnb MCP)
         6. **Transportation Overview** - Detailed transportation options, costs, and recommendations (use Google Maps MCP)
@@ -223,26 +212,686 @@ async def run_mcp_travel_planner(source: str, destination: str, num_days: int, p
            - Health and medical considerations
            - Shopping and souvenir recommendations
 
-        Use Flight Search MCP tools (search_flights, search_airports, get_flight_prices) for real flight data, Airbnb MCP for real accommodation data, Google Maps MCP for ALL distance calculations and location services, and web search for current information.
+        Use {flight_data_source} for real flight data, Airbnb MCP for real accommodation data, Google Maps MCP for ALL distance calculations and location services, and web search for current information.
         Make reasonable assumptions and fill in any gaps with your knowledge.
         Generate the complete, highly detailed itinerary in one response without asking for clarification.
         """
 
-        response = await travel_planner.arun(prompt)
-        return response.content
+class TravelPlannerApp:
+    """Main application class for Travel Planner with MCP integration."""
+    
+    def __init__(self):
+        """Initialize the application."""
+        pass
+    
+
+        
+
+
+class ResultCache:
+    """Process-wide TTL caches for tool responses and itineraries, one cache per name."""
+
+    def __init__(self, default_ttl: int, ttls: dict = None, maxsize: int = TOOL_CACHE_MAXSIZE):
+        """Initialize the empty caches with a TTL per name and a fallback TTL."""
+        self._default_ttl = default_ttl
+        self._ttls = ttls or {}
+        self._maxsize = maxsize
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(tool_name: str, arguments: dict) -> tuple:
+        """Build the cache key for a tool call from its name and arguments."""
+        return (tool_name, orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS, default=str))
+
+    def _cache_for(self, tool_name: str) -> TTLCache:
+        if tool_name not in self._caches:
+            ttl = self._ttls.get(tool_name, self._default_ttl)
+            self._caches[tool_name] = TTLCache(maxsize=self._maxsize, ttl=ttl)
+        return self._caches[tool_name]
+
+    def get_results_from_cache(self, tool_name: str, arguments: dict):
+        """Return the cached response for a tool call, or None if missing or expired."""
+        with self._lock:
+            return self._cache_for(tool_name).get(self.make_key(tool_name, arguments))
+
+    def save_to_cache(self, tool_name: str, arguments: dict, result: str) -> None:
+        """Store a tool response for reuse within the tool's TTL."""
+        with self._lock:
+            self._cache_for(tool_name)[self.make_key(tool_name, arguments)] = result
+
+    def clear(self) -> None:
+        """Drop every cached entry."""
+        with self._lock:
+            self._caches.clear()
+
+@st.cache_resource(show_spinner=False)
+def get_tool_result_cache() -> ResultCache:
+    """Return the MCP tool result cache shared by all sessions and reruns."""
+    return ResultCache(DEFAULT_TOOL_CACHE_TTL_SECONDS, TOOL_CACHE_TTL_SECONDS)
+
+@st.cache_resource(show_spinner=False)
+def get_itinerary_cache() -> ResultCache:
+    """Return the generated itinerary cache shared by all sessions and reruns."""
+    return ResultCache(ITINERARY_CACHE_TTL_SECONDS, maxsize=ITINERARY_CACHE_MAXSIZE)
+
+class AirportCache:
+    """On-disk cache of airport metadata keyed by IATA code, backed by a bundled seed file."""
+
+    def __init__(self, path: str, seed_path: str, ttl: int):
+        """Load previously fetched airports and the seed entries."""
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._seed = self._load(seed_path)
+        self._entries = self._load(path)
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        try:
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable airport cache {path}: {str(e)}")
+            return {}
+
+    def get(self, iata_code: str):
+        """Return airport metadata for an IATA code, or None if unknown or expired."""
+        code = iata_code.strip().upper()
+        with self._lock:
+            entry = self._entries.get(code)
+        if entry is not None and time.time() - entry["fetched_at"] < self._ttl:
+            return entry["data"]
+        return self._seed.get(code)
+
+    def save(self, iata_code: str, data) -> None:
+        """Store airport metadata and persist the cache file."""
+        with self._lock:
+            self._entries[iata_code.strip().upper()] = {"fetched_at": time.time(), "data": data}
+            try:
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+                tmp_path = f"{self._path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(orjson.dumps(self._entries))
+                os.replace(tmp_path, self._path)
+            except OSError as e:
+                logger.warning(f"Could not write airport cache {self._path}: {str(e)}")
+
+@st.cache_resource(show_spinner=False)
+def get_airport_cache() -> AirportCache:
+    """Return the on-disk airport cache shared by all sessions and reruns."""
+    return AirportCache(AIRPORT_CACHE_PATH, AIRPORT_SEED_PATH, AIRPORT_CACHE_TTL_SECONDS)
+
+def _cached_tool_entrypoint(tool_name: str, entrypoint, cache: ResultCache):
+    """Wrap an MCP tool entrypoint so repeated calls with the same arguments hit the cache."""
+
+    async def call_tool(agent, **kwargs) -> str:
+        cached = cache.get_results_from_cache(tool_name, kwargs)
+        if cached is not None:
+            logger.info(f"Cache hit for MCP tool '{tool_name}'")
+            return cached
+
+        result = await entrypoint(agent=agent, **kwargs)
+        # MCP entrypoints report failures as "Error: ..." strings; never cache those
+        if not result.startswith("Error:"):
+            cache.save_to_cache(tool_name, kwargs, result)
+        return result
+
+    return call_tool
+
+def cache_mcp_tool_results(toolkit) -> None:
+    """Route every tool registered on a connected MCP toolkit through the shared result cache."""
+    cache = get_tool_result_cache()
+    for function in toolkit.functions.values():
+        function.entrypoint = _cached_tool_entrypoint(function.name, function.entrypoint, cache)
+
+def clear_cache() -> None:
+    """Clear cached itineraries and MCP tool responses."""
+    get_itinerary_cache().clear()
+    get_tool_result_cache().clear()
+
+def _escape_ics_text(value: str) -> str:
+    """Escape a TEXT property value as required by RFC 5545."""
+    return (
+        value.replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+def _fold_ics_line(line: str) -> bytes:
+    """Encode a content line, folding it at 75 octets without splitting UTF-8 characters."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return data
+
+    chunks = []
+    start, limit = 0, 75
+    while len(data) - start > limit:
+        end = start + limit
+        # Back off to the first byte of a multi-byte character
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        chunks.append(data[start:end])
+        # Continuation lines begin with a space, which counts towards the limit
+        start, limit = end, 74
+    chunks.append(data[start:])
+    return b'\r\n '.join(chunks)
+
+def _ics_event_lines(summary: str, description: str, event_date: datetime, dtstamp: str) -> list:
+    """Build the content lines of a single all-day VEVENT."""
+    day = event_date.strftime('%Y%m%d')
+    return [
+        'BEGIN:VEVENT',
+        f'SUMMARY:{_escape_ics_text(summary)}',
+        f'DTSTART;VALUE=DATE:{day}',
+        f'DTEND;VALUE=DATE:{day}',
+        f'DTSTAMP:{dtstamp}',
+        f'DESCRIPTION:{_escape_ics_text(description)}',
+        'END:VEVENT',
+    ]
+
+def generate_ics_content(plan_text: str, start_date: datetime = None) -> bytes:
+    """
+    Generate an ICS calendar file from a travel itinerary text.
+
+    Args:
+        plan_text: The travel itinerary text
+        start_date: Optional start date for the itinerary (defaults to today)
+
+    Returns:
+        bytes: The ICS file content as bytes
+    """
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//AI Travel Planner//github.com//',
+    ]
+
+    if start_date is None:
+        start_date = datetime.today()
+
+    # Split the plan into days
+    days = list(_DAY_PATTERN.finditer(plan_text))
+    dtstamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    if not days:  # If no day pattern found, create a single all-day event with the entire content
+        lines.extend(_ics_event_lines("Travel Itinerary", plan_text, start_date, dtstamp))
+    else:
+        # Process each day
+        for match in days:
+            day_num = int(match.group(1))
+            current_date = start_date + timedelta(days=day_num - 1)
+
+            # Create a single all-day event for the entire day
+            description = plan_text[match.start(2):match.end(2)].strip()
+            lines.extend(_ics_event_lines(f"Day {day_num} Itinerary", description, current_date, dtstamp))
+
+    lines.append('END:VCALENDAR')
+    return b'\r\n'.join(_fold_ics_line(line) for line in lines) + b'\r\n'
+
+def detect_mcp_usage(response: str) -> list:
+    """Return the MCP servers whose data appears in an itinerary, using a single scan of the text."""
+    found = {match.group(0).lower() for match in _MCP_MARKER_PATTERN.finditer(response)}
+
+    mcp_status = []
+    if found & _FLIGHT_MARKERS:
+        mcp_status.append("✈️ Flight Search MCP")
+    if "airbnb" in found and found & _AIRBNB_MARKERS:
+        mcp_status.append("🏨 Airbnb MCP")
+    if "distance" in found and found & _MAPS_MARKERS:
+        mcp_status.append("🗺️ Google Maps MCP")
+    return mcp_status
+
+async def _prefetch_tool(functions: dict, semaphore: asyncio.Semaphore, tool_name: str, arguments: dict):
+    """Call a single MCP tool directly, returning None when it is unavailable or fails."""
+    function = functions.get(tool_name)
+    if function is None:
+        return None
+
+    async with semaphore:
+        try:
+            result = await function.entrypoint(agent=None, **arguments)
+        except Exception as e:
+            logger.warning(f"Pre-fetch of MCP tool '{tool_name}' failed: {str(e)}")
+            return None
+
+    if result.startswith("Error:"):
+        logger.warning(f"Pre-fetch of MCP tool '{tool_name}' failed: {result}")
+        return None
+    try:
+        return orjson.loads(result)
+    except ValueError:
+        return result
+
+def _airport_search_arguments(functions: dict, iata_code: str) -> dict:
+    """Build search_airports arguments from the parameter name advertised in the tool schema."""
+    function = functions.get("search_airports")
+    schema = (function.parameters or {}) if function is not None else {}
+    names = schema.get("required") or list(schema.get("properties", {})) or ["query"]
+    return {names[0]: iata_code}
+
+async def prefetch_flight_data(mcp_tools: list, source: str, destination: str, start_date: str) -> dict:
+    """Fetch flights, airport details, and price trends concurrently before the agent runs."""
+    functions = {name: function for toolkit in mcp_tools for name, function in toolkit.functions.items()}
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PREFETCH_CALLS)
+    route = {"source": source, "destination": destination, "departure_date": start_date}
+
+    # Airports already on disk skip the search_airports call entirely
+    airport_cache = get_airport_cache()
+    airports = {code: airport_cache.get(code) for code in (source, destination)}
+    missing = [code for code, data in airports.items() if data is None]
+
+    flights, prices, *fetched_airports = await asyncio.gather(
+        _prefetch_tool(functions, semaphore, "search_flights", route),
+        _prefetch_tool(functions, semaphore, "get_flight_prices", route),
+        *(_prefetch_tool(functions, semaphore, "search_airports", _airport_search_arguments(functions, code)) for code in missing),
+    )
+    for code, data in zip(missing, fetched_airports):
+        # Free-text replies such as "no airports found" must not be cached for a month
+        if isinstance(data, (dict, list)) and data:
+            # Rewriting the cache file is blocking I/O, so keep it off the event loop
+            await asyncio.to_thread(airport_cache.save, code, data)
+            airports[code] = data
+
+    prefetched = {}
+    if flights is not None:
+        prefetched["search_flights"] = flights
+    if all(data is not None for data in airports.values()):
+        prefetched["search_airports"] = airports
+    if prices is not None:
+        prefetched["get_flight_prices"] = prices
+    return prefetched
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Start the long-lived event loop that owns the MCP connections and runs the agent."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="mcp-event-loop", daemon=True).start()
+    return loop
+
+class MCPConnections:
+    """MCP toolkits whose connections are each held open by one long-lived task on the shared event loop."""
+
+    def __init__(self, toolkits: list):
+        """Initialize the set with toolkits that are not connected yet."""
+        self.toolkits = toolkits
+        self.broken = False
+        self._owners = []
+        self._shutdown = None
+        self._users = 0
+        self._retired = False
+
+    async def _own(self, toolkit, ready: asyncio.Future) -> None:
+        # MCP transports are anyio contexts, so the task that enters one must also be the one that exits it
+        connected = False
+        try:
+            await toolkit.connect()
+            connected = True
+            if not ready.done():
+                ready.set_result(None)
+            await self._shutdown.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.error(f"MCP connection failed: {str(e)}")
+        finally:
+            if connected and not self._shutdown.is_set():
+                # The transport went away underneath the owner; stop handing these connections out
+                self.broken = True
+            if not ready.done():
+                # Transport failures can surface as a cancellation of this task rather than an exception
+                ready.set_exception(ConnectionError(f"Could not connect to MCP server {toolkit.url or toolkit.server_params.command}"))
+            try:
+                await toolkit.close()
+            except Exception as e:
+                logger.error(f"Error closing MCP tools: {str(e)}")
+
+    async def connect(self) -> None:
+        """Connect to every MCP server concurrently so start-up costs the slowest server, not the sum."""
+        loop = asyncio.get_running_loop()
+        self._shutdown = asyncio.Event()
+        ready = [loop.create_future() for _ in self.toolkits]
+        self._owners = [loop.create_task(self._own(toolkit, future)) for toolkit, future in zip(self.toolkits, ready)]
+        try:
+            results = await asyncio.gather(*ready, return_exceptions=True)
+        except BaseException:
+            await self.close()
+            raise
 
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await self.close()
+            raise errors[0]
+
+    async def close(self) -> None:
+        """Tell every owner task to exit its connection and wait until they have."""
+        if self._shutdown is not None:
+            self._shutdown.set()
+        await asyncio.gather(*self._owners, return_exceptions=True)
+
+    async def check(self) -> None:
+        """Ping every MCP server and mark the connections broken if any of them does not answer."""
+        # Tool calls report transport failures as "Error: ..." strings, so a dead server is only noticed here
+        results = await asyncio.gather(
+            *(asyncio.wait_for(toolkit.session.send_ping(), MCP_PING_TIMEOUT_SECONDS) for toolkit in self.toolkits),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"MCP server did not answer a ping: {result!r}")
+                self.broken = True
+
+    def acquire(self) -> None:
+        """Record that a run is using the connections."""
+        self._users += 1
+
+    async def release(self) -> None:
+        """Record that a run is done with the connections, closing them if they were retired."""
+        self._users -= 1
+        if self._retired and self._users == 0:
+            await self.close()
+
+    async def retire(self) -> None:
+        """Stop using the connections, closing them once no run holds them."""
+        self._retired = True
+        if self._users == 0:
+            await self.close()
+
+def _close_mcp_connections(connections: MCPConnections) -> None:
+    """Close the MCP server connections on the event loop that opened them."""
+    try:
+        asyncio.run_coroutine_threadsafe(connections.close(), get_event_loop()).result(timeout=10)
     except Exception as e:
-        logger.error(f"Error in MCP travel planner: {str(e)}\n{traceback.format_exc()}")
+        logger.error(f"Error closing MCP tools: {str(e)}")
+
+async def _connect_mcp_servers() -> MCPConnections:
+    """Connect to all MCP servers and route their tools through the shared result cache."""
+    google_maps_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    if not google_maps_key:
+        raise ValueError("Missing required API keys in environment variables")
+
+    env = {
+        "GOOGLE_MAPS_API_KEY": google_maps_key,
+        "SERPAPI_KEY": os.getenv("SERPAPI_KEY", ""),
+    }
+
+    # One toolkit per server so the connections can be established in parallel
+    mcp_tools = [MCPTools(command, env=env, timeout_seconds=MCP_TIMEOUT_SECONDS) for command in MCP_SERVER_COMMANDS]
+    mcp_tools.append(MCPTools(url=FLIGHT_SEARCH_MCP_URL, transport="streamable-http", timeout_seconds=MCP_TIMEOUT_SECONDS))
+
+    # Connect to all MCP servers; a failed connect closes whatever did come up
+    connections = MCPConnections(mcp_tools)
+    await connections.connect()
+
+    for toolkit in mcp_tools:
+        cache_mcp_tool_results(toolkit)
+    return connections
+
+class SharedMCPConnections:
+    """The MCP connections shared across requests, established on the event loop by the first run that needs them."""
+
+    def __init__(self):
+        """Initialize without connecting; the first call to acquire() connects."""
+        self._connections = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> MCPConnections:
+        """Return the shared connections for one run, connecting first if there are none or they broke."""
+        async with self._lock:
+            if self._connections is not None and not self._connections.broken:
+                await self._connections.check()
+            if self._connections is not None and self._connections.broken:
+                await self.retire(self._connections)
+            if self._connections is None:
+                self._connections = await _connect_mcp_servers()
+            self._connections.acquire()
+            return self._connections
+
+    async def retire(self, connections: MCPConnections) -> None:
+        """Make the next run reconnect; runs still using the old connections keep them until they finish."""
+        if self._connections is connections:
+            self._connections = None
+        await connections.retire()
+
+    def shutdown(self) -> None:
+        """Close the current connections from outside the event loop."""
+        if self._connections is not None:
+            _close_mcp_connections(self._connections)
+
+@st.cache_resource(show_spinner=False)
+def get_shared_mcp_connections() -> SharedMCPConnections:
+    """Return the MCP connections holder shared by all sessions and reruns."""
+    shared = SharedMCPConnections()
+    atexit.register(shared.shutdown)
+    return shared
+
+@st.cache_resource(show_spinner=False)
+def get_openai_http_client() -> httpx.AsyncClient:
+    """Return the HTTP client whose connection pool is shared by every OpenAI request."""
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100))
+
+def _build_travel_planner(mcp_tools: list, openai_key: str) -> Agent:
+    """Create a travel planner agent for one run with the connected MCP toolkits and web search."""
+    # Agents and models keep per-run state, so only the HTTP client and the MCP connections are shared.
+    # The description and instructions depend on the pre-fetch and are set once it has finished.
+    return Agent(
+        name="Travel Planner",
+        role="Creates comprehensive travel itineraries using Airbnb, Google Maps, and Flight Search MCP servers",
+        model=OpenAIChat(id="gpt-4o", api_key=openai_key, http_client=get_openai_http_client()),
+        tools=[*mcp_tools, GoogleSearchTools()],
+        add_datetime_to_instructions=True,
+        markdown=True,
+        show_tool_calls=False,
+    )
+
+def _agent_flight_guidance(prefetched: dict) -> tuple:
+    """Build the agent description and instructions, steering the agent away from flight tools whose results were pre-fetched."""
+    tool_lines = [
+        _AGENT_PREFETCHED_TOOL_INSTRUCTION.format(tool_name=tool_name) if tool_name in prefetched else line
+        for tool_name, line in _AGENT_FLIGHT_TOOL_INSTRUCTIONS.items()
+    ]
+    description = _AGENT_DESCRIPTION.format(flight_guidance=_PREFETCHED_FLIGHT_GUIDANCE if prefetched else _FLIGHT_GUIDANCE)
+    instructions = [
+        _AGENT_LEADING_INSTRUCTION,
+        _PREFETCHED_FLIGHT_TOOLS_HEADER if prefetched else _FLIGHT_TOOLS_HEADER,
+        *tool_lines,
+        *_AGENT_INSTRUCTIONS,
+    ]
+    return description, instructions
+
+def _flight_data_source(prefetched: dict) -> str:
+    """Describe where the itinerary's flight data comes from for the closing prompt line."""
+    remaining = [tool_name for tool_name in _FLIGHT_TOOL_INSTRUCTIONS if tool_name not in prefetched]
+    tools = f"Flight Search MCP tools ({', '.join(remaining)})"
+    if not prefetched:
+        return tools
+    if not remaining:
+        return "the pre-fetched Flight Search MCP data"
+    return f"the pre-fetched Flight Search MCP data and {tools}"
+
+async def run_mcp_travel_planner(mcp_tools: list, source: str, destination: str, num_days: int, preferences: str, budget: int, start_date: str, return_date: str = None):
+    """Run the MCP-based travel planner agent with real-time data access."""
+
+    # Start the independent flight lookups immediately so they are in flight while the agent is set up
+    prefetch_task = asyncio.create_task(prefetch_flight_data(mcp_tools, source, destination, start_date))
+
+    try:
+        # Get API keys from environment variables
+        openai_key = os.getenv("OPENAI_API_KEY")
+
+        if not openai_key:
+            raise ValueError("Missing required API keys in environment variables")
+
+        # Build the agent off the event loop so the pre-fetch keeps making progress meanwhile
+        travel_planner = await asyncio.to_thread(_build_travel_planner, mcp_tools, openai_key)
+
+        fields = {
+            "source": source,
+            "destination": destination,
+            "start_date": start_date,
+            "return_date": return_date if return_date else "One-way trip",
+            "num_days": num_days,
+            "budget": budget,
+            "preferences": preferences,
+        }
+
+        prefetched = await prefetch_task
+        logger.info(f"Pre-fetched Flight Search MCP data: {', '.join(prefetched) or 'none'}")
+        travel_planner.description, travel_planner.instructions = _agent_flight_guidance(prefetched)
+
+        flight_tools = "\n          ".join(
+            (_PREFETCHED_TOOL_INSTRUCTION if tool_name in prefetched else template).format_map(
+                dict(fields, tool_name=tool_name, block=_PREFETCHED_BLOCKS.get(tool_name, "prefetched_data"))
+            )
+            for tool_name, template in _FLIGHT_TOOL_INSTRUCTIONS.items()
+        )
+
+        # Airport details get their own block; flight offers and price trends go in <prefetched_data>
+        flight_data = {name: data for name, data in prefetched.items() if name != "search_airports"}
+        prefetched_section = ""
+        if flight_data:
+            prefetched_section += _PREFETCHED_SECTION_TEMPLATE.format(data=orjson.dumps(flight_data).decode())
+        if "search_airports" in prefetched:
+            prefetched_section += _AIRPORT_INFO_SECTION_TEMPLATE.format(data=orjson.dumps(prefetched["search_airports"]).decode())
+
+        # Point every flight section of the prompt at the pre-fetched data instead of the tools where possible
+        flight_sources = {
+            f"{tool_name}_source": (_PREFETCHED_OUTPUT_SOURCE if tool_name in prefetched else _OUTPUT_TOOL_SOURCE).format(
+                tool_name=tool_name, block=_PREFETCHED_BLOCKS.get(tool_name, "prefetched_data")
+            )
+            for tool_name in _FLIGHT_TOOL_INSTRUCTIONS
+        }
+
+        # Create the planning prompt
+        prompt = _PROMPT_TEMPLATE.format_map(dict(
+            fields,
+            **flight_sources,
+            flight_tools_header=_PREFETCHED_FLIGHT_TOOLS_HEADER if prefetched else _FLIGHT_TOOLS_HEADER,
+            flight_tools=flight_tools,
+            flight_data_source=_flight_data_source(prefetched),
+            prefetched_section=prefetched_section,
+        ))
+
+        # Stream the response so the UI can render the itinerary as it is generated
+        async for chunk in await travel_planner.arun(prompt, stream=True):
+            if isinstance(chunk, RunResponseContentEvent) and isinstance(chunk.content, str):
+                yield chunk.content
+            # agno reports failed and cancelled runs as events rather than exceptions
+            elif isinstance(chunk, RunResponseErrorEvent):
+                raise RuntimeError(f"Travel planner agent failed: {chunk.content}")
+            elif isinstance(chunk, RunResponseCancelledEvent):
+                raise RuntimeError(f"Travel planner agent run was cancelled: {chunk.reason}")
+
+    except Exception as e:
+        logger.exception("Error in MCP travel planner: %s", e)
         raise e
     finally:
+        if not prefetch_task.done():
+            prefetch_task.cancel()
+
+class PlannerRun:
+    """An itinerary generation on the shared event loop that outlives individual Streamlit reruns."""
+
+    def __init__(self, cached: str = None):
+        """Initialize the run, optionally already completed with a cached itinerary."""
+        self._chunks = [cached] if cached is not None else []
+        self._done = cached is not None
+        self._error = None
+        self._changed = threading.Condition()
+        self._future = None
+        self._started_at = time.monotonic()
+
+    async def _produce(self, shared: SharedMCPConnections, params: dict, cache: ResultCache, cache_key: dict) -> None:
+        connections = None
         try:
-            await multi_mcp_tools.close()
+            # Connecting here rather than on the script thread keeps the progress status visible during a cold start
+            connections = await shared.acquire()
+            async for chunk in run_mcp_travel_planner(connections.toolkits, **params):
+                with self._changed:
+                    self._chunks.append(chunk)
+                    self._changed.notify_all()
+            itinerary = "".join(self._chunks)
+            if not itinerary.strip():
+                raise RuntimeError("The travel planner returned an empty itinerary")
+            # Only complete itineraries are cached
+            cache.save_to_cache("itinerary", cache_key, itinerary)
+        except asyncio.CancelledError as e:
+            self._error = e
+            raise
         except Exception as e:
-            logger.error(f"Error closing MCP tools: {str(e)}")
+            self._error = e
+            # Only transport failures make the shared connections unusable; other errors leave them for other runs
+            if connections is not None and (connections.broken or isinstance(e, _CONNECTION_ERRORS)):
+                await shared.retire(connections)
+        finally:
+            with self._changed:
+                self._done = True
+                self._changed.notify_all()
+            if connections is not None:
+                await connections.release()
+
+    def start(self, shared: SharedMCPConnections, params: dict, cache: ResultCache, cache_key: dict) -> None:
+        """Submit the generation to the shared event loop without waiting for it."""
+        self._future = asyncio.run_coroutine_threadsafe(self._produce(shared, params, cache, cache_key), get_event_loop())
+
+    def cancel(self) -> None:
+        """Stop the generation if it is still running."""
+        if self._future is not None:
+            self._future.cancel()
+
+    def elapsed(self) -> float:
+        """Seconds since the run started."""
+        return time.monotonic() - self._started_at
+
+    def stream(self, on_wait=None):
+        """Yield the text generated so far, then new text as it arrives; raise if the generation failed."""
+        index = 0
+        while True:
+            with self._changed:
+                if index == len(self._chunks) and not self._done:
+                    self._changed.wait(timeout=PLANNER_POLL_SECONDS)
+                new_chunks = self._chunks[index:]
+                done = self._done
+
+            if new_chunks:
+                index += len(new_chunks)
+                yield "".join(new_chunks)
+            elif done:
+                break
+            elif on_wait is not None:
+                # Give Streamlit a chance to handle widget interactions while the agent is busy
+                on_wait()
 
-def run_travel_planner(source: str, destination: str, num_days: int, preferences: str, budget: int, start_date: str, return_date: str = None):
-    """Synchronous wrapper for the async MCP travel planner."""
-    return asyncio.run(run_mcp_travel_planner(source, destination, num_days, preferences, budget, start_date, return_date))
+        if self._error is not None:
+            raise self._error
+
+def start_planner_run(source: str, destination: str, num_days: int, preferences: str, budget: int, start_date: str, return_date: str = None) -> PlannerRun:
+    """Start generating an itinerary in the background, or return a completed run on a cache hit."""
+    params = {
+        "source": source.strip().upper(),
+        "destination": destination.strip().upper(),
+        "num_days": int(num_days),
+        "preferences": preferences.strip(),
+        "budget": int(budget),
+        "start_date": start_date,
+        "return_date": return_date,
+    }
+    key_params = dict(params, preferences=params["preferences"].lower())
+
+    cache = get_itinerary_cache()
+    cached = cache.get_results_from_cache("itinerary", key_params)
+    if cached is not None:
+        logger.info("Serving itinerary from cache")
+        return PlannerRun(cached)
+
+    planner_run = PlannerRun()
+    planner_run.start(get_shared_mcp_connections(), params, cache, key_params)
+    return planner_run
 
 # Initialize the app
 app = TravelPlannerApp()
@@ -259,11 +908,21 @@ st.set_page_config(
 # Initialize session state
 if 'itinerary' not in st.session_state:
     st.session_state.itinerary = None
+if 'planner_run' not in st.session_state:
+    st.session_state.planner_run = None
+if 'ics_content' not in st.session_state:
+    st.session_state.ics_content = None
+    st.session_state.ics_key = None
 
 # Title and description
 st.title("✈️ MCP AI Travel Planner")
 st.caption("Plan your next adventure with AI Travel Planner using multiple MCP servers for real-time data access")
 
+with st.sidebar:
+    if st.button("🧹 Clear cached results", help="Force fresh flight, accommodation, and itinerary data"):
+        clear_cache()
+        st.success("Cached results cleared.")
+
 if 1:
     # Main input section
     st.header("🌍 Trip Details")
@@ -282,6 +941,11 @@ if 1:
         start_date = st.date_input("Start Date", min_value=date.today(), value=date.today())
         return_date = st.date_input("Return Date (Optional)", min_value=date.today(), value=date.today() + timedelta(days=7))
 
+    # Midnight of the start date, recomputed only when the picked date changes
+    if st.session_state.get('start_dt_date') != start_date:
+        st.session_state.start_dt = datetime.combine(start_date, datetime.min.time())
+        st.session_state.start_dt_date = start_date
+
     # Preferences section
     st.subheader("🎯 Travel Preferences")
     preferences_input = st.text_area(
@@ -299,18 +963,23 @@ if 1:
         help="Select multiple preferences or describe in detail above"
     )
 
-    # Combine preferences
-    all_preferences = []
-    if preferences_input:
-        all_preferences.append(preferences_input)
-    if quick_prefs:
-        all_preferences.extend(quick_prefs)
+    # Combine preferences, dropping case-insensitive duplicates while keeping the first spelling
+    unique_preferences = {}
+    for pref in preferences_input.split(",") + sorted(quick_prefs):
+        pref = pref.strip()
+        if pref:
+            unique_preferences.setdefault(pref.casefold(), pref)
+    all_preferences = list(unique_preferences.values())
 
     preferences = ", ".join(all_preferences) if all_preferences else "General sightseeing"
 
     # Generate button
     col1, col2 = st.columns([1, 1])
 
+    # Full-width area below the buttons where the itinerary is streamed and displayed
+    itinerary_area = st.container()
+    itinerary_streamed = False
+
     with col1:
         if st.button("🎯 Generate Itinerary", type="primary"):
             if not destination:
@@ -318,60 +987,79 @@ if 1:
             elif not preferences:
                 st.warning("Please describe your preferences or select quick preferences.")
             else:
-                tools_message = "✈️ Connecting to Flight Search MCP, 🏨 Airbnb MCP, and 🗺️ Google Maps MCP, creating comprehensive itinerary..."
-
-                with st.spinner(tools_message):
-                    try:
-                        # Calculate number of days from start date
-                        response = run_travel_planner(
-                            source=source,
-                            destination=destination,
-                            num_days=num_days,
-                            preferences=preferences,
-                            budget=budget,
-                            start_date=start_date.strftime("%Y-%m-%d"),
-                            return_date=return_date.strftime("%Y-%m-%d") if return_date else None
-                        )
-
-                        # Store the response in session state
-                        st.session_state.itinerary = response
-
-                        # Show MCP connection status
-                        mcp_status = []
-                        if any(term in response.lower() for term in ["search_flights", "search_airports", "get_flight_prices", "serpapi_response", "flight data", "airline", "booking link"]):
-                            mcp_status.append("✈️ Flight Search MCP")
-                        if "airbnb" in response.lower() and ("listing" in response.lower() or "accommodation" in response.lower()):
-                            mcp_status.append("🏨 Airbnb MCP")
-                        if "distance" in response.lower() and ("maps" in response.lower() or "location" in response.lower()):
-                            mcp_status.append("🗺️ Google Maps MCP")
-                        
-                        if mcp_status:
-                            st.success("✅ Your comprehensive travel itinerary is ready!")
-                            st.info(f"Used: {', '.join(mcp_status)} for real-time data")
-                        else:
-                            st.success("✅ Your travel itinerary is ready!")
-                            st.info("📝 Used general knowledge for recommendations (some MCP servers may have failed to connect)")
-
-                    except Exception as e:
-                        logger.error(f"Error generating itinerary: {str(e)}\n{traceback.format_exc()}")
-                        st.error(f"Error: {str(e)}")
-                        st.info("Please try again or check your internet connection and API keys.")
+                try:
+                    # Generation runs on the background event loop, so later reruns pick it back up
+                    if st.session_state.planner_run is not None:
+                        st.session_state.planner_run.cancel()
+                    st.session_state.planner_run = start_planner_run(
+                        source=source,
+                        destination=destination,
+                        num_days=num_days,
+                        preferences=preferences,
+                        budget=budget,
+                        start_date=start_date.isoformat(),
+                        return_date=return_date.isoformat() if return_date else None
+                    )
+                except Exception as e:
+                    logger.exception("Error generating itinerary: %s", e)
+                    st.error(f"Error: {str(e)}")
+                    st.info("Please try again or check your internet connection and API keys.")
+
+        planner_run = st.session_state.planner_run
+        if planner_run is not None:
+            tools_message = "✈️ Connecting to Flight Search MCP, 🏨 Airbnb MCP, and 🗺️ Google Maps MCP, creating comprehensive itinerary..."
+            status = st.status(tools_message)
+
+            def show_progress():
+                status.update(label=f"{tools_message} ({planner_run.elapsed():.0f}s)")
+
+            try:
+                # Render tokens as they arrive instead of waiting for the full itinerary
+                with itinerary_area:
+                    st.header("📋 Your Comprehensive Travel Itinerary")
+                    itinerary_streamed = True
+                    response = st.write_stream(planner_run.stream(on_wait=show_progress))
+
+                # Store the response in session state
+                st.session_state.planner_run = None
+                st.session_state.itinerary = response
+                status.update(label=f"Itinerary generated in {planner_run.elapsed():.0f}s", state="complete")
+
+                # Show MCP connection status
+                mcp_status = detect_mcp_usage(response)
+                if mcp_status:
+                    st.success("✅ Your comprehensive travel itinerary is ready!")
+                    st.info(f"Used: {', '.join(mcp_status)} for real-time data")
+                else:
+                    st.success("✅ Your travel itinerary is ready!")
+                    st.info("📝 Used general knowledge for recommendations (some MCP servers may have failed to connect)")
+
+            except Exception as e:
+                st.session_state.planner_run = None
+                status.update(label="Itinerary generation failed", state="error")
+                logger.exception("Error generating itinerary: %s", e)
+                st.error(f"Error: {str(e)}")
+                st.info("Please try again or check your internet connection and API keys.")
 
     with col2:
         if st.session_state.itinerary:
-            # Generate the ICS file
-            ics_content = generate_ics_content(st.session_state.itinerary, datetime.combine(start_date, datetime.min.time()))
+            # Regenerate the ICS file only when the itinerary or start date changed since the last rerun
+            ics_key = (id(st.session_state.itinerary), start_date)
+            if st.session_state.ics_key != ics_key:
+                st.session_state.ics_content = generate_ics_content(st.session_state.itinerary, st.session_state.start_dt)
+                st.session_state.ics_key = ics_key
 
             # Provide the file for download
             st.download_button(
                 label="📅 Download as Calendar",
-                data=ics_content,
+                data=st.session_state.ics_content,
                 file_name="travel_itinerary.ics",
                 mime="text/calendar"
             )
 
     # Display itinerary
-    if st.session_state.itinerary:
-        st.header("📋 Your Comprehensive Travel Itinerary")
-        st.markdown(st.session_state.itinerary)
+    if st.session_state.itinerary and not itinerary_streamed:
+        with itinerary_area:
+            st.header("📋 Your Comprehensive Travel Itinerary")
+            st.markdown(st.session_state.itinerary)
 